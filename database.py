@@ -1,6 +1,9 @@
+import hashlib
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, insert, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
 
 # Use environment variable or default to sqlite for testing
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///:memory:')
@@ -29,8 +32,14 @@ class Meeting(Base):
     location = Column(String)
     description = Column(String)
     updated = Column(String)
+    etag = Column(String)
+    content_hash = Column(String(32))
 
-engine = create_engine(DATABASE_URL)
+if DATABASE_URL.startswith("sqlite") and ":memory:" in DATABASE_URL:
+    # Share the single in-memory database with the bot's worker threads
+    engine = create_engine(DATABASE_URL, poolclass=StaticPool, connect_args={"check_same_thread": False})
+else:
+    engine = create_engine(DATABASE_URL)
 Base.metadata.create_all(bind=engine)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
@@ -60,3 +69,62 @@ def set_user_info(session, user_id, username, fullname):
     us.username = username
     us.fullname = fullname
     session.commit()
+
+UPSERT_BATCH_SIZE = 500
+MEETING_FIELDS = (
+    "title", "start_time", "end_time", "attendants", "hangoutLink", "location", "description",
+    "updated", "etag", "content_hash",
+)
+# Fields that make up a meeting's content; updated and etag change on any edit
+CONTENT_FIELDS = ("title", "start_time", "end_time", "attendants", "hangoutLink", "location", "description")
+
+def meeting_content_hash(values):
+    """Stable hash of the normalized content fields of a meeting row."""
+    digest = hashlib.blake2b(digest_size=16)
+    for field in CONTENT_FIELDS:
+        value = values.get(field)
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        digest.update(("" if value is None else str(value)).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+_native_inserts = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def upsert_meetings(session, rows):
+    """Bulk INSERT meeting rows, updating any row whose id already exists.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite and a
+    plain bulk INSERT elsewhere. Each id must appear only once in rows.
+    """
+    if not rows:
+        return
+    native_insert = _native_inserts.get(session.get_bind().dialect.name)
+    if native_insert is None:
+        session.execute(insert(Meeting), rows)
+        return
+    # Batched to stay below the bound-parameter limits of multi-row VALUES
+    for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+        stmt = native_insert(Meeting).values(rows[i:i + UPSERT_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Meeting.id],
+            set_={field: stmt.excluded[field] for field in MEETING_FIELDS}
+        )
+        session.execute(stmt)
+
+def update_meetings(session, rows):
+    """Bulk UPDATE meeting rows by primary key."""
+    if rows:
+        session.execute(update(Meeting), rows)
+
+def delete_meetings(session, ids):
+    """Bulk DELETE meetings by id."""
+    if ids:
+        session.execute(delete(Meeting).where(Meeting.id.in_(ids)))
+
+def delete_meetings_except(session, keep_ids):
+    """Bulk DELETE every meeting whose id is not in keep_ids."""
+    session.execute(delete(Meeting).where(Meeting.id.notin_(keep_ids)))
@@ -7,6 +7,10 @@ GOOGLE_SERVICE_ACCOUNT_KEY = os.environ.get("GOOGLE_SERVICE_ACCOUNT_KEY", "fake_
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "123")
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./test.db")
 WEB_APP_URL = os.environ.get("WEB_APP_URL", "https://example.com")
+GOOGLE_API_TIMEOUT = int(os.environ.get("GOOGLE_API_TIMEOUT", "30"))
+GOOGLE_EVENTS_PAGE_SIZE = int(os.environ.get("GOOGLE_EVENTS_PAGE_SIZE", "250"))
+REFRESH_CHUNK_SIZE = int(os.environ.get("REFRESH_CHUNK_SIZE", "100"))
+REFRESH_TIMEOUT = int(os.environ.get("REFRESH_TIMEOUT", "240"))
 
 WEBHOOK_PORT = 443
 TIMEZONE_UA = "Europe/Kiev"
@@ -1,28 +1,199 @@
+import datetime
+import itertools
 import json
+import logging
+import threading
+import time
+import httplib2
 from dateutil import parser, tz
+from google_auth_httplib2 import AuthorizedHttp, Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.oauth2.service_account import Credentials
-from .config import GOOGLE_SERVICE_ACCOUNT_KEY, GOOGLE_CALENDAR_ID, TIMEZONE_UA, TIMEZONE_TH
+from .config import (GOOGLE_SERVICE_ACCOUNT_KEY, GOOGLE_CALENDAR_ID, GOOGLE_EVENTS_PAGE_SIZE,
+                     GOOGLE_API_TIMEOUT, TIMEZONE_UA, TIMEZONE_TH)
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+
+class CalendarClient:
+    """Long-lived Calendar API client shared by every refresh.
+
+    The service account key and the discovery document are parsed once, all
+    requests go through a single keep-alive HTTP connection and the access
+    token is only refreshed once it has expired.
+    """
+
+    def __init__(self, service_account_key=GOOGLE_SERVICE_ACCOUNT_KEY, timeout=GOOGLE_API_TIMEOUT, service=None):
+        self._service_account_key = service_account_key
+        self._timeout = timeout
+        self._service = service
+        self._credentials = None
+        self._http = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.last_latency = None
+        self.last_error = None
+        self.last_success_at = None
+
+    @property
+    def service(self):
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    self._credentials = Credentials.from_service_account_info(
+                        json.loads(self._service_account_key), scopes=SCOPES
+                    )
+                    self._http = AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self._timeout))
+                    self._service = build('calendar', 'v3', http=self._http, cache_discovery=False)
+                    logger.info("Calendar API client initialized")
+        return self._service
+
+    def warm_up(self):
+        """Build the service and mint the first access token ahead of the first refresh."""
+        self.service
+        if self._credentials is not None and not self._credentials.valid:
+            self._credentials.refresh(Request(self._http.http))
+
+    def execute(self, request):
+        """Execute an API request, recording its latency and outcome."""
+        started = time.monotonic()
+        self.requests += 1
+        try:
+            response = request.execute()
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            raise
+        finally:
+            self.last_latency = time.monotonic() - started
+        self.last_success_at = datetime.datetime.now(tz.UTC)
+        return response
+
+    def health(self):
+        return {
+            "ready": self._service is not None,
+            "token_valid": bool(self._credentials is not None and self._credentials.valid),
+            "requests": self.requests,
+            "errors": self.errors,
+            "last_latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at.isoformat() if self.last_success_at else None,
+        }
+
+calendar_client = CalendarClient()
 
 def get_calendar_service():
-    creds = Credentials.from_service_account_info(json.loads(GOOGLE_SERVICE_ACCOUNT_KEY))
-    service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
-    return service
+    return calendar_client.service
 
-def fetch_meetings_from_gcal(start_dt, end_dt):
-    service = get_calendar_service()
-    events_result = service.events().list(
-        calendarId=GOOGLE_CALENDAR_ID,
+def iter_event_pages(client, page_size=GOOGLE_EVENTS_PAGE_SIZE, **params):
+    """Yield each page of events().list as it arrives, following nextPageToken."""
+    page_token = None
+    while True:
+        events_result = client.execute(client.service.events().list(
+            calendarId=GOOGLE_CALENDAR_ID,
+            maxResults=page_size,
+            pageToken=page_token,
+            **params
+        ))
+        yield events_result
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return
+
+def iter_meetings_from_gcal(start_dt, end_dt, page_size=GOOGLE_EVENTS_PAGE_SIZE):
+    """Yield transformed meetings of the window one page at a time."""
+    pages = iter_event_pages(
+        calendar_client,
+        page_size=page_size,
         timeMin=start_dt.isoformat(),
         timeMax=end_dt.isoformat(),
         singleEvents=True,
         orderBy='startTime'
-    ).execute()
-    events = events_result.get('items', [])
-    meetings = []
-    for e in events:
-        meetings.append(transform_event_to_meeting(e))
-    return meetings
+    )
+    for page in pages:
+        for e in page.get('items', []):
+            yield transform_event_to_meeting(e)
+
+def fetch_meetings_from_gcal(start_dt, end_dt):
+    return list(iter_meetings_from_gcal(start_dt, end_dt))
+
+def _in_window(meeting, start_dt, end_dt):
+    return meeting["end_ua"] > start_dt and meeting["start_ua"] < end_dt
+
+class CalendarSync:
+    """Meetings streamed page by page from one sync pass.
+
+    full_sync tells whether the meetings are the complete window or only the
+    changes since the previous sync token. removed_ids and sync_token are
+    complete once the meetings have been iterated to the end.
+    """
+
+    def __init__(self, pages, start_dt, end_dt, full_sync):
+        self._pages = pages
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.full_sync = full_sync
+        self.removed_ids = []
+        self.sync_token = None
+
+    def __iter__(self):
+        for page in self._pages:
+            for e in page.get('items', []):
+                if e.get('status') == 'cancelled':
+                    self.removed_ids.append(e.get('id', ''))
+                    continue
+                m = transform_event_to_meeting(e)
+                # Changes outside the window are treated as removals
+                if self.full_sync or _in_window(m, self.start_dt, self.end_dt):
+                    yield m
+                else:
+                    self.removed_ids.append(m["id"])
+            if not page.get('nextPageToken'):
+                self.sync_token = page.get('nextSyncToken')
+
+    def chunks(self, size):
+        """Yield the meetings in lists of at most size items."""
+        chunk = []
+        for m in self:
+            chunk.append(m)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def sync_meetings_from_gcal(start_dt, end_dt, sync_token=None, page_size=GOOGLE_EVENTS_PAGE_SIZE):
+    """Start an incremental sync using a Calendar API sync token.
+
+    Without a token, or when Google answers 410 Gone for an expired one, the
+    whole window is listed again. The first page is requested eagerly so an
+    expired token is detected here; the rest is fetched while iterating.
+    """
+    if sync_token:
+        pages = iter_event_pages(
+            calendar_client, page_size=page_size, syncToken=sync_token, singleEvents=True, showDeleted=True
+        )
+        try:
+            first_page = next(pages)
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            logger.warning("Sync token expired, falling back to full sync")
+        else:
+            return CalendarSync(itertools.chain([first_page], pages), start_dt, end_dt, full_sync=False)
+
+    # orderBy is not allowed when a nextSyncToken is requested
+    pages = iter_event_pages(
+        calendar_client,
+        page_size=page_size,
+        timeMin=start_dt.isoformat(),
+        timeMax=end_dt.isoformat(),
+        singleEvents=True
+    )
+    return CalendarSync(pages, start_dt, end_dt, full_sync=True)
 
 def transform_event_to_meeting(event):
     start = parser.isoparse(event['start'].get('dateTime', event['start'].get('date')))
@@ -57,5 +228,6 @@ def transform_event_to_meeting(event):
         "location": event.get('location',''),
         "hangoutLink": event.get('hangoutLink',''),
         "description": event.get('description',''),
-        "updated": event.get('updated','')
+        "updated": event.get('updated',''),
+        "etag": event.get('etag','')
     }
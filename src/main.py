@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import logging.config
 
@@ -9,16 +10,23 @@ from telegram.ext import Application
 from .config import TELEGRAM_BOT_TOKEN, TELEGRAM_WEBHOOK_URL, WEBHOOK_PORT
 from .start import start_handler
 from .gets import (get_today_handler, get_tomorrow_handler, get_rest_week_handler, get_next_week_handler)
-from .notifications import refresh_meetings, notification_job
+from .notifications import refresh_meetings, send_due_reminders
+from .reminders import reminder_scheduler
+from .google_calendar import calendar_client
 from .localization import STRINGS
 
 async def error_handler(update, context):
     logger.error(f"Exception while handling an update: {update}", exc_info=context.error)
 
 async def startup(application):
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, calendar_client.warm_up)
+        logger.info(f"Calendar API client ready: {calendar_client.health()}")
+    except Exception as e:
+        logger.error(f"Failed to warm up Calendar API client: {str(e)}")
     await refresh_meetings()
     application.job_queue.run_repeating(refresh_meetings, interval=300)
-    application.job_queue.run_repeating(notification_job, interval=60)
+    application.create_task(reminder_scheduler.run(send_due_reminders))
     logger.info("Startup tasks completed.")
 
 if __name__ == "__main__":
@@ -1,17 +1,27 @@
+import asyncio
 import datetime
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import tz
+from sqlalchemy import or_
 from telegram import Bot
-from .config import TIMEZONE_TH, TELEGRAM_BOT_TOKEN  # Add relative import
-from database import SessionLocal, Meeting, UserSettings
+from .config import TIMEZONE_TH, TELEGRAM_BOT_TOKEN, REFRESH_CHUNK_SIZE, REFRESH_TIMEOUT  # Add relative import
+from database import (SessionLocal, Meeting, UserSettings, upsert_meetings, update_meetings,
+                      delete_meetings, delete_meetings_except, meeting_content_hash)
 from .localization import STRINGS
 from .utils import get_next_week_th
-from .google_calendar import fetch_meetings_from_gcal
+from .google_calendar import sync_meetings_from_gcal, calendar_client
 from .formatters import formatted_meeting
+from .reminders import reminder_scheduler, REMINDER_SETTINGS
 
 logger = logging.getLogger(__name__)
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 
+# Calendar sync token of the last successful refresh and the window it covers.
+# A new window (day rollover) or a restart forces a full sync.
+_sync_state = {"token": None, "window": None}
+
 def safe_get_meeting_data(meeting, field, default=None):
     """Safely get meeting data with null checking."""
     if meeting is None:
@@ -60,24 +70,92 @@ async def send_notification(user_id, meeting, is_new=False):
     except Exception as e:
         logger.error(f"Failed to send notification to user {user_id}: {str(e)}")
 
-async def refresh_meetings(context=None):
-    """Refresh meetings from Google Calendar."""
-    logger.info("Starting meetings refresh")
-    
-    now = datetime.datetime.now(tz.gettz(TIMEZONE_TH))
-    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    _, end = get_next_week_th()
-    logger.info(f"Fetching meetings from {start} to {end}")
-    
+def _meeting_row_values(m):
+    """Column values of a Meeting row for a transformed calendar meeting."""
+    values = {
+        "title": m.get("title", "Untitled"),
+        # Store everything in UTC
+        "start_time": normalize_datetime(m.get("start_ua")),
+        "end_time": normalize_datetime(m.get("end_ua")),
+        "attendants": ",".join(m.get("attendants", []) or []),
+        "hangoutLink": m.get("hangoutLink", ""),
+        "location": m.get("location", ""),
+        "description": m.get("description", ""),
+        "updated": m.get("updated"),
+        "etag": m.get("etag") or None,
+    }
+    values["content_hash"] = meeting_content_hash(values)
+    return values
+
+def _content_changed(existing_meeting, m, values):
+    if existing_meeting.content_hash:
+        return existing_meeting.content_hash != values["content_hash"]
+    # Rows stored before content hashes existed are compared field by field
+    return _meeting_changed(existing_meeting, m)
+
+def _meeting_changed(existing_meeting, m):
+    title_old = existing_meeting.title or ""
+    title_new = m.get("title") or ""
+    if title_old != title_new:
+        logger.debug(f"Title changed: '{title_old}' -> '{title_new}'")
+
+    attendants_old = existing_meeting.attendants or ""
+    attendants_new = ",".join(m.get("attendants", []) or [])
+    if attendants_old != attendants_new:
+        logger.debug(f"Attendants changed: '{attendants_old}' -> '{attendants_new}'")
+
+    hangout_old = existing_meeting.hangoutLink or ""
+    hangout_new = m.get("hangoutLink") or ""
+    if hangout_old != hangout_new:
+        logger.debug(f"Hangout link changed: '{hangout_old}' -> '{hangout_new}'")
+
+    location_old = existing_meeting.location or ""
+    location_new = m.get("location") or ""
+    if location_old != location_new:
+        logger.debug(f"Location changed: '{location_old}' -> '{location_new}'")
+
+    desc_old = existing_meeting.description or ""
+    desc_new = m.get("description") or ""
+    if desc_old != desc_new:
+        logger.debug(f"Description changed: '{desc_old}' -> '{desc_new}'")
+
+    return (
+        title_old != title_new or
+        not compare_datetimes(existing_meeting.start_time, m.get("start_ua")) or
+        not compare_datetimes(existing_meeting.end_time, m.get("end_ua")) or
+        attendants_old != attendants_new or
+        hangout_old != hangout_new or
+        location_old != location_new or
+        desc_old != desc_new
+    )
+
+async def _notify_subscribers(subscribers, m):
+    for user in subscribers:
+        if user and user.user_id and (
+            not user.filter_by_attendant or 
+            (user.username and user.username in (m.get("attendants", []) or []))
+        ):
+            logger.debug(f"Notifying user {user.user_id} about meeting {m['id']}")
+            await send_notification(user.user_id, m, is_new=True)
+
+class RefreshCancelled(Exception):
+    """Raised inside the refresh worker once its refresh timed out or was cancelled."""
+
+# A single worker keeps refreshes serialized: one that overruns its timeout
+# delays the next refresh instead of running alongside it
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+
+def _sync_meetings_to_db(start, end, sync_token, cancel_event):
+    """Fetch, compare and store meetings. Runs on the refresh executor.
+
+    Returns (subscribers, changed meetings, sync token) after the commit, or
+    None when nothing was stored.
+    """
     try:
-        meetings = fetch_meetings_from_gcal(start, end)
-        if not meetings:
-            logger.warning("No meetings returned from Google Calendar")
-            return
-        logger.info(f"Successfully fetched {len(meetings)} meetings from Google Calendar")
+        sync = sync_meetings_from_gcal(start, end, sync_token)
     except Exception as e:
         logger.error(f"Failed to fetch meetings: {str(e)}")
-        return
+        return None
 
     session = SessionLocal()
     try:
@@ -87,187 +165,189 @@ async def refresh_meetings(context=None):
             logger.debug(f"Found {len(subscribers)} subscribers for new meeting notifications")
         else:
             logger.info("No subscribers found for notifications")
+        # Detach them so they stay readable once the session is closed
+        for user in subscribers:
+            session.expunge(user)
         
-        existing_meetings = {m.id: m for m in session.query(Meeting).all() if m and m.id}
-        logger.debug(f"Found {len(existing_meetings)} existing meetings in database")
-        
-        new_count = 0
+        seen_ids = set()
         updated_count = 0
-        
-        # First compare meetings without modifying the database
-        for m in meetings:
-            if not m or not m.get("id"):
-                logger.warning("Skipping invalid meeting entry")
-                continue
-                
-            existing_meeting = existing_meetings.get(m.get("id"))
-            if not existing_meeting:
-                new_count += 1
-                logger.debug(f"New meeting found: {m.get('title', 'Untitled')} ({m.get('id')})")
-                # Only notify if there are subscribers
-                if subscribers:
-                    for user in subscribers:
-                        if user and user.user_id and (
-                            not user.filter_by_attendant or 
-                            (user.username and user.username in (m.get("attendants", []) or []))
-                        ):
-                            logger.debug(f"Notifying user {user.user_id} about new meeting {m['id']}")
-                            await send_notification(user.user_id, m, is_new=True)
-            else:
-                # Move comparison block inside the else clause
-                title_old = existing_meeting.title or ""
-                title_new = m.get("title") or ""
-                if title_old != title_new:
-                    logger.debug(f"Title changed: '{title_old}' -> '{title_new}'")
-
-                attendants_old = existing_meeting.attendants or ""
-                attendants_new = ",".join(m.get("attendants", []) or [])
-                if attendants_old != attendants_new:
-                    logger.debug(f"Attendants changed: '{attendants_old}' -> '{attendants_new}'")
-
-                hangout_old = existing_meeting.hangoutLink or ""
-                hangout_new = m.get("hangoutLink") or ""
-                if hangout_old != hangout_new:
-                    logger.debug(f"Hangout link changed: '{hangout_old}' -> '{hangout_new}'")
-
-                location_old = existing_meeting.location or ""
-                location_new = m.get("location") or ""
-                if location_old != location_new:
-                    logger.debug(f"Location changed: '{location_old}' -> '{location_new}'")
-
-                desc_old = existing_meeting.description or ""
-                desc_new = m.get("description") or ""
-                if desc_old != desc_new:
-                    logger.debug(f"Description changed: '{desc_old}' -> '{desc_new}'")
-
-                if (
-                    title_old != title_new or
-                    not compare_datetimes(existing_meeting.start_time, m.get("start_ua")) or
-                    not compare_datetimes(existing_meeting.end_time, m.get("end_ua")) or
-                    attendants_old != attendants_new or
-                    hangout_old != hangout_new or
-                    location_old != location_new or
-                    desc_old != desc_new
-                ):
-                    updated_count += 1
+        new_rows = {}
+        changed_rows = []
+        changed = []
+
+        # Meetings are compared one chunk at a time so memory stays bounded by
+        # the chunk size plus the changes, instead of the size of the window
+        for chunk in sync.chunks(REFRESH_CHUNK_SIZE):
+            if cancel_event.is_set():
+                raise RefreshCancelled()
+            chunk_ids = [m.get("id") for m in chunk if m and m.get("id")]
+            existing_meetings = {
+                m.id: m for m in session.query(Meeting).filter(Meeting.id.in_(chunk_ids)).all()
+                if m and m.id
+            }
+
+            for m in chunk:
+                if not m or not m.get("id"):
+                    logger.warning("Skipping invalid meeting entry")
+                    continue
+
+                existing_meeting = existing_meetings.get(m["id"])
+                if existing_meeting is not None and m.get("etag") and existing_meeting.etag == m["etag"]:
+                    # Unchanged since it was stored: nothing to normalize or compare
+                    seen_ids.add(m["id"])
+                    continue
+
+                values = _meeting_row_values(m)
+                if not values["start_time"] or not values["end_time"]:
+                    logger.warning(f"Skipping meeting {m['id']} due to missing time data")
+                    continue
+                seen_ids.add(m["id"])
+
+                if not existing_meeting:
+                    logger.debug(f"New meeting found: {m.get('title', 'Untitled')} ({m['id']})")
+                    changed.append(m)
+                    new_rows[m["id"]] = {"id": m["id"], **values}
+                elif _content_changed(existing_meeting, m, values):
                     logger.debug(f"Updated meeting found: {m['title']} ({m['id']})")
-                    if subscribers:
-                        for user in subscribers:
-                            if user and user.user_id and (
-                                not user.filter_by_attendant or 
-                                (user.username and user.username in (m.get("attendants", []) or []))
-                            ):
-                                logger.debug(f"Notifying user {user.user_id} about updated meeting {m['id']}")
-                                await send_notification(user.user_id, m, is_new=True)
-        
-        # Update database regardless of subscribers
-        session.query(Meeting).delete()
-        logger.debug("Cleared existing meetings from database")
-        
-        for m in meetings:
-            if not m or not m.get("id"):
-                continue
-                
-            meeting = Meeting(
-                id=m.get("id"),
-                title=m.get("title", "Untitled"),
-                # Store everything in UTC
-                start_time=normalize_datetime(m.get("start_ua")),
-                end_time=normalize_datetime(m.get("end_ua")),
-                attendants=",".join(m.get("attendants", []) or []),
-                hangoutLink=m.get("hangoutLink", ""),
-                location=m.get("location", ""),
-                description=m.get("description", ""),
-                updated=m.get("updated"),
-            )
-            
-            if not meeting.start_time or not meeting.end_time:
-                logger.warning(f"Skipping meeting {meeting.id} due to missing time data")
-                continue
-                
-            session.add(meeting)
-        
+                    changed.append(m)
+                    updated_count += 1
+                    changed_rows.append({"id": m["id"], **values})
+                elif (existing_meeting.etag, existing_meeting.content_hash) != (values["etag"], values["content_hash"]):
+                    # Same content under a new etag, or a row stored before hashing
+                    changed_rows.append({"id": m["id"], **values})
+
+        if sync.full_sync and not seen_ids:
+            logger.warning("No meetings returned from Google Calendar")
+            session.rollback()
+            return None
+        if cancel_event.is_set():
+            raise RefreshCancelled()
+
+        # Write only the difference, in one short transaction
+        upsert_meetings(session, list(new_rows.values()))
+        update_meetings(session, changed_rows)
+        if sync.full_sync:
+            logger.info(f"Successfully fetched {len(seen_ids)} meetings from Google Calendar")
+            delete_meetings_except(session, seen_ids)
+            logger.debug("Removed meetings that left the calendar window")
+        elif sync.removed_ids:
+            delete_meetings(session, sync.removed_ids)
+            logger.debug(f"Removed {len(sync.removed_ids)} meetings from database")
+        new_count = len(new_rows)
+
         session.commit()
         logger.info(f"Refresh complete. New meetings: {new_count}, Updated meetings: {updated_count}")
+        logger.debug(f"Calendar API client health: {calendar_client.health()}")
+        return subscribers, changed, sync.sync_token
+    except RefreshCancelled:
+        logger.warning("Meetings refresh cancelled, changes rolled back")
+        session.rollback()
     except Exception as e:
         logger.error(f"Error during refresh: {str(e)}")
         session.rollback()
     finally:
         session.close()
+    return None
 
-async def notification_job(_context):
-    logger.debug("Starting notification job")
-    now = datetime.datetime.now(tz.UTC)
+async def refresh_meetings(context=None):
+    """Refresh meetings from Google Calendar."""
+    logger.info("Starting meetings refresh")
     
+    now = datetime.datetime.now(tz.gettz(TIMEZONE_TH))
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    _, end = get_next_week_th()
+    logger.info(f"Fetching meetings from {start} to {end}")
+    
+    window = (start, end)
+    sync_token = _sync_state["token"] if _sync_state["window"] == window else None
+
+    # Blocking API and database work runs off the event loop so bot updates
+    # keep being served while a refresh is in flight
+    cancel_event = threading.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        result = await asyncio.wait_for(
+            loop.run_in_executor(_refresh_executor, _sync_meetings_to_db, start, end, sync_token, cancel_event),
+            timeout=REFRESH_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        cancel_event.set()
+        logger.error(f"Meetings refresh timed out after {REFRESH_TIMEOUT} seconds")
+        return
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+    if result is not None:
+        _sync_state["token"] = result[2]
+        _sync_state["window"] = window
+
+    # Reloaded even when the calendar could not be reached, so reminders for
+    # meetings already stored are scheduled right after a restart
+    try:
+        schedule = await loop.run_in_executor(_refresh_executor, _load_reminder_schedule)
+        reminder_scheduler.load(schedule)
+    except Exception as e:
+        logger.error(f"Failed to reload reminder schedule: {str(e)}")
+
+    if result is not None:
+        subscribers, changed, _ = result
+        for m in changed:
+            await _notify_subscribers(subscribers, m)
+
+def _load_reminder_schedule():
+    """(meeting_id, start_time) of upcoming meetings. Runs on the refresh executor."""
     session = SessionLocal()
     try:
-        meetings = session.query(Meeting).all() or []
-        users = session.query(UserSettings).all() or []
-        logger.debug(f"Processing {len(meetings)} meetings for {len(users)} users")
-        
-        notifications_sent = 0
-        for meeting in meetings:
-            if not meeting or not meeting.start_time:
-                logger.warning(f"Skipping invalid meeting: {getattr(meeting, 'id', 'unknown')}")
+        now = datetime.datetime.now(tz.UTC)
+        return session.query(Meeting.id, Meeting.start_time).filter(Meeting.start_time > now).all()
+    finally:
+        session.close()
+
+def _load_due_reminders(due):
+    """Resolve due reminders into (user_id, meeting) deliveries. Runs on an executor."""
+    session = SessionLocal()
+    try:
+        meeting_ids = {meeting_id for meeting_id, _, _ in due}
+        meetings = {m.id: m for m in session.query(Meeting).filter(Meeting.id.in_(meeting_ids)).all()}
+        users = session.query(UserSettings).filter(or_(
+            UserSettings.notify_1h == True,
+            UserSettings.notify_15m == True,
+            UserSettings.notify_5m == True
+        )).all()
+        logger.debug(f"Resolving {len(due)} due reminders for {len(users)} users")
+
+        deliveries = []
+        for meeting_id, kind, start in due:
+            meeting = meetings.get(meeting_id)
+            if not meeting or not compare_datetimes(meeting.start_time, start):
+                logger.debug(f"Skipping stale {kind} reminder for meeting {meeting_id}")
                 continue
-                
-            start = normalize_datetime(meeting.start_time)
-            
-            minutes_until = (start - now).total_seconds() / 60.0
-            logger.debug(f"Meeting {meeting.id} starts in {minutes_until:.1f} minutes")
-            
-            # Define notification windows with wider tolerances
-            notification_windows = [
-                (60, 1.0, "1-hour"),     # 60 minutes ± 2 minutes
-                (15, 1.0, "15-minute"),   # 15 minutes ± 1 minute
-                (5, 1.0, "5-minute")      # 5 minutes ± 30 seconds
-            ]
-            
-            for target_minutes, tolerance, window_name in notification_windows:
-                window_min = target_minutes - tolerance
-                window_max = target_minutes + tolerance
-                in_window = window_min <= minutes_until <= window_max
-                
-                logger.debug(
-                    f"Checking {window_name} window for meeting {meeting.id}: "
-                    f"window={window_min:.1f}-{window_max:.1f}, "
-                    f"minutes_until={minutes_until:.1f}, matches={in_window}"
-                )
-                
-                if in_window:
-                    for user in users:
-                        if not user or not user.user_id:
-                            continue
-                            
-                        should_notify = (
-                            (target_minutes == 60 and user.notify_1h) or
-                            (target_minutes == 15 and user.notify_15m) or
-                            (target_minutes == 5 and user.notify_5m)
-                        )
-                        
-                        if should_notify:
-                            attendants = (meeting.attendants or "").split(",") if meeting.attendants else []
-                            if not user.filter_by_attendant or (
-                                user.username and 
-                                user.username in attendants
-                            ):
-                                logger.debug(f"Sending {window_name} notification to user {user.user_id}")
-                                # Convert meeting to dict format with proper timezone info
-                                meeting_dict = {
-                                    "id": meeting.id,
-                                    "title": meeting.title or "Untitled",
-                                    "start_time": meeting.start_time,  # Let formatter handle conversion
-                                    "end_time": meeting.end_time,      # Let formatter handle conversion
-                                    "attendants": attendants,
-                                    "hangoutLink": meeting.hangoutLink or "",
-                                    "location": meeting.location or "",
-                                    "description": meeting.description or "",
-                                }
-                                await send_notification(user.user_id, meeting_dict)
-                                notifications_sent += 1
-        
-        logger.info(f"Notification job complete. Sent {notifications_sent} notifications")
-    except Exception as e:
-        logger.error(f"Error during notification job: {str(e)}")
+
+            attendants = (meeting.attendants or "").split(",") if meeting.attendants else []
+            meeting_dict = {
+                "id": meeting.id,
+                "title": meeting.title or "Untitled",
+                "start_time": meeting.start_time,  # Let formatter handle conversion
+                "end_time": meeting.end_time,      # Let formatter handle conversion
+                "attendants": attendants,
+                "hangoutLink": meeting.hangoutLink or "",
+                "location": meeting.location or "",
+                "description": meeting.description or "",
+            }
+            for user in users:
+                if not user or not user.user_id or not getattr(user, REMINDER_SETTINGS[kind]):
+                    continue
+                if not user.filter_by_attendant or (user.username and user.username in attendants):
+                    deliveries.append((user.user_id, meeting_dict))
+        return deliveries
     finally:
         session.close()
+
+async def send_due_reminders(due):
+    """Send the reminders the scheduler found due."""
+    loop = asyncio.get_running_loop()
+    deliveries = await loop.run_in_executor(None, _load_due_reminders, due)
+    for user_id, meeting_dict in deliveries:
+        await send_notification(user_id, meeting_dict)
+    logger.info(f"Sent {len(deliveries)} reminders for {len(due)} due reminder slots")
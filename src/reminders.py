@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import heapq
+import logging
+from dateutil import tz
+
+logger = logging.getLogger(__name__)
+
+# Reminder kind -> how long before the meeting start it fires
+REMINDER_OFFSETS = {
+    "1h": datetime.timedelta(minutes=60),
+    "15m": datetime.timedelta(minutes=15),
+    "5m": datetime.timedelta(minutes=5),
+}
+# Reminder kind -> UserSettings flag that enables it
+REMINDER_SETTINGS = {
+    "1h": "notify_1h",
+    "15m": "notify_15m",
+    "5m": "notify_5m",
+}
+
+def _as_utc(dt):
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=tz.UTC)
+    return dt.astimezone(tz.UTC)
+
+class ReminderScheduler:
+    """Fire times of upcoming reminders, kept in a heap ordered by time.
+
+    The schedule is reloaded whenever meetings are ingested and run() sleeps
+    until the earliest fire time, so idle minutes cost nothing and reminders
+    go out when they are due rather than on the next polling tick.
+    """
+
+    def __init__(self, now=None):
+        self._heap = []
+        self._wake = asyncio.Event()
+        # Everything due up to this moment has already been handed out
+        self._fired_until = now or datetime.datetime.now(tz.UTC)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def load(self, meetings):
+        """Replace the schedule with reminders for (meeting_id, start_time) pairs."""
+        heap = []
+        for meeting_id, start_time in meetings:
+            if not meeting_id or not start_time:
+                continue
+            start = _as_utc(start_time)
+            for kind, offset in REMINDER_OFFSETS.items():
+                fire_at = start - offset
+                if fire_at > self._fired_until:
+                    heap.append((fire_at, meeting_id, kind, start))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._wake.set()
+        logger.debug(f"Scheduled {len(heap)} reminders, next at {self.next_fire_time()}")
+
+    def next_fire_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Remove and return (meeting_id, kind, start_time) of reminders due by now."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, meeting_id, kind, start = heapq.heappop(self._heap)
+            due.append((meeting_id, kind, start))
+        self._fired_until = max(self._fired_until, now)
+        return due
+
+    async def run(self, deliver):
+        """Hand due reminders to the deliver coroutine, sleeping until the next one."""
+        while True:
+            self._wake.clear()
+            now = datetime.datetime.now(tz.UTC)
+            due = self.pop_due(now)
+            if due:
+                try:
+                    await deliver(due)
+                except Exception as e:
+                    logger.error(f"Failed to deliver reminders: {str(e)}")
+                continue
+
+            next_fire = self.next_fire_time()
+            timeout = (next_fire - now).total_seconds() if next_fire else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+reminder_scheduler = ReminderScheduler()
@@ -1,9 +1,16 @@
 import pytest
+from datetime import datetime
+from unittest.mock import patch
 from database import (  # Updated import path
     get_user_settings,
     set_filter,
     set_notifications,
     set_user_info,
+    upsert_meetings,
+    update_meetings,
+    delete_meetings,
+    delete_meetings_except,
+    meeting_content_hash,
     UserSettings,
     Meeting,
     SessionLocal
@@ -65,3 +72,59 @@ def test_set_user_info(db_session):
     settings = get_user_settings(db_session, user_id)
     assert settings.username == username
     assert settings.fullname == fullname
+
+def meeting_row(meeting_id, title="Meeting"):
+    return {
+        "id": meeting_id,
+        "title": title,
+        "start_time": datetime(2024, 12, 17, 8, 0),
+        "end_time": datetime(2024, 12, 17, 9, 0),
+        "attendants": "@user1",
+        "hangoutLink": "",
+        "location": "",
+        "description": "",
+        "updated": "2024-12-12T16:59:47.499Z",
+    }
+
+@pytest.fixture
+def meetings_session(db_session):
+    db_session.query(Meeting).delete()
+    db_session.commit()
+    yield db_session
+    db_session.rollback()
+    db_session.query(Meeting).delete()
+    db_session.commit()
+
+def test_upsert_meetings_inserts_and_updates(meetings_session):
+    upsert_meetings(meetings_session, [meeting_row("a"), meeting_row("b")])
+    upsert_meetings(meetings_session, [meeting_row("b", title="Renamed"), meeting_row("c")])
+    meetings_session.commit()
+
+    titles = {m.id: m.title for m in meetings_session.query(Meeting).all()}
+    assert titles == {"a": "Meeting", "b": "Renamed", "c": "Meeting"}
+
+def test_upsert_meetings_batches(meetings_session):
+    with patch('database.UPSERT_BATCH_SIZE', 2):
+        upsert_meetings(meetings_session, [meeting_row(str(i)) for i in range(5)])
+    meetings_session.commit()
+    assert meetings_session.query(Meeting).count() == 5
+
+def test_update_and_delete_meetings(meetings_session):
+    upsert_meetings(meetings_session, [meeting_row("a"), meeting_row("b"), meeting_row("c")])
+    update_meetings(meetings_session, [meeting_row("a", title="Changed")])
+    delete_meetings(meetings_session, ["b"])
+    meetings_session.commit()
+
+    titles = {m.id: m.title for m in meetings_session.query(Meeting).all()}
+    assert titles == {"a": "Changed", "c": "Meeting"}
+
+    delete_meetings_except(meetings_session, {"c"})
+    meetings_session.commit()
+    assert [m.id for m in meetings_session.query(Meeting).all()] == ["c"]
+
+def test_meeting_content_hash():
+    row = meeting_row("a")
+    assert meeting_content_hash(row) == meeting_content_hash(dict(row))
+    # Bookkeeping fields do not affect the hash, content fields do
+    assert meeting_content_hash(row) == meeting_content_hash(dict(row, updated="later", etag="x"))
+    assert meeting_content_hash(row) != meeting_content_hash(dict(row, location="Room 2"))
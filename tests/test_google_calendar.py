@@ -1,8 +1,22 @@
 import pytest
+import httplib2
 from unittest.mock import patch, Mock
 from datetime import datetime, timedelta
 from dateutil import tz
-from src.google_calendar import get_calendar_service, fetch_meetings_from_gcal, transform_event_to_meeting
+from googleapiclient.errors import HttpError
+from src.google_calendar import (
+    CalendarClient,
+    get_calendar_service,
+    fetch_meetings_from_gcal,
+    iter_meetings_from_gcal,
+    sync_meetings_from_gcal,
+    transform_event_to_meeting
+)
+
+@pytest.fixture(autouse=True)
+def fresh_client():
+    with patch('src.google_calendar.calendar_client', CalendarClient()) as client:
+        yield client
 
 @pytest.fixture
 def sample_event():
@@ -53,8 +67,52 @@ def test_get_calendar_service(mock_credentials):
         assert mock_build.called
         assert service is not None
 
+def test_calendar_client_builds_service_once(mock_credentials):
+    with patch('src.google_calendar.build') as mock_build, \
+         patch('src.google_calendar.json.loads', return_value={'type': 'service_account'}) as mock_loads:
+        client = CalendarClient()
+        assert client.health()["ready"] is False
+
+        assert client.service is client.service
+        mock_loads.assert_called_once()
+        mock_credentials.from_service_account_info.assert_called_once()
+        mock_build.assert_called_once()
+        assert 'credentials' not in mock_build.call_args.kwargs
+        assert client.health()["ready"] is True
+
+def test_calendar_client_warm_up_refreshes_invalid_token(mock_credentials):
+    creds = mock_credentials.from_service_account_info.return_value
+    creds.valid = False
+    with patch('src.google_calendar.build'), \
+         patch('src.google_calendar.json.loads', return_value={'type': 'service_account'}):
+        client = CalendarClient()
+        client.warm_up()
+        creds.refresh.assert_called_once()
+
+        creds.refresh.reset_mock()
+        creds.valid = True
+        client.warm_up()
+        creds.refresh.assert_not_called()
+
+def test_calendar_client_execute_records_health():
+    client = CalendarClient(service=Mock())
+    request = Mock()
+    request.execute.return_value = {'items': []}
+    assert client.execute(request) == {'items': []}
+
+    request.execute.side_effect = Exception("boom")
+    with pytest.raises(Exception):
+        client.execute(request)
+
+    health = client.health()
+    assert health["requests"] == 2
+    assert health["errors"] == 1
+    assert health["last_error"] == "boom"
+    assert health["last_latency_ms"] is not None
+    assert health["last_success_at"] is not None
+
 def test_fetch_meetings_from_gcal(mock_service):
-    with patch('src.google_calendar.get_calendar_service', return_value=mock_service):
+    with patch('src.google_calendar.calendar_client', CalendarClient(service=mock_service)):
         start = datetime.now(tz.UTC)
         end = start + timedelta(days=1)
         meetings = fetch_meetings_from_gcal(start, end)
@@ -81,3 +139,110 @@ def test_transform_event_to_meeting():
     assert meeting['location'] == 'Room 1'
     assert meeting['hangoutLink'] == 'https://meet.google.com/123'
     assert meeting['description'] == 'Test description'
+
+class FakeEventsEndpoint:
+    """Minimal in-memory stand-in for the Calendar events().list endpoint."""
+
+    def __init__(self, events):
+        self.events = {e['id']: e for e in events}
+        self.version = 0
+        self.changed = {}
+        self.expired_tokens = set()
+        self.requests = []
+
+    def change(self, event):
+        self.version += 1
+        self.events[event['id']] = event
+        self.changed[event['id']] = self.version
+
+    def events_resource(self):
+        return self
+
+    def list(self, **params):
+        self.requests.append(params)
+        request = Mock()
+        request.execute.side_effect = lambda: self._execute(params)
+        return request
+
+    def _execute(self, params):
+        sync_token = params.get('syncToken')
+        if sync_token in self.expired_tokens:
+            raise HttpError(httplib2.Response({'status': 410}), b'Gone')
+        if sync_token:
+            since = int(sync_token)
+            items = [self.events[i] for i, v in self.changed.items() if v > since]
+        else:
+            items = [e for e in self.events.values() if e.get('status') != 'cancelled']
+        page_size = params['maxResults']
+        offset = int(params.get('pageToken') or 0)
+        result = {'items': items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            result['nextPageToken'] = str(offset + page_size)
+        else:
+            result['nextSyncToken'] = str(self.version)
+        return result
+
+def make_event(event_id, day=17, **extra):
+    event = {
+        'id': event_id,
+        'summary': f'Meeting {event_id}',
+        'start': {'dateTime': f'2024-12-{day}T15:00:00+07:00'},
+        'end': {'dateTime': f'2024-12-{day}T16:00:00+07:00'},
+    }
+    event.update(extra)
+    return event
+
+@pytest.fixture
+def fake_endpoint():
+    endpoint = FakeEventsEndpoint([make_event('a'), make_event('b'), make_event('c')])
+    service = Mock()
+    service.events.side_effect = endpoint.events_resource
+    with patch('src.google_calendar.calendar_client', CalendarClient(service=service)):
+        yield endpoint
+
+@pytest.fixture
+def sync_window():
+    start = datetime(2024, 12, 16, tzinfo=tz.UTC)
+    return start, start + timedelta(days=7)
+
+def test_iter_meetings_from_gcal_follows_pages(fake_endpoint, sync_window):
+    meetings = iter_meetings_from_gcal(*sync_window, page_size=2)
+    assert next(meetings)['id'] == 'a'
+    # Only the first page has been requested so far
+    assert len(fake_endpoint.requests) == 1
+    assert [m['id'] for m in meetings] == ['b', 'c']
+    assert len(fake_endpoint.requests) == 2
+    assert fake_endpoint.requests[0]['maxResults'] == 2
+    assert fake_endpoint.requests[1]['pageToken'] == '2'
+
+def test_sync_meetings_full_sync_walks_all_pages(fake_endpoint, sync_window):
+    sync = sync_meetings_from_gcal(*sync_window, page_size=2)
+    assert sync.full_sync
+    assert [len(chunk) for chunk in sync.chunks(2)] == [2, 1]
+    assert sync.removed_ids == []
+    assert sync.sync_token == '0'
+    assert len(fake_endpoint.requests) == 2
+    assert 'orderBy' not in fake_endpoint.requests[0]
+
+def test_sync_meetings_incremental(fake_endpoint, sync_window):
+    sync = sync_meetings_from_gcal(*sync_window)
+    list(sync)
+    fake_endpoint.change(make_event('b', summary='Renamed'))
+    fake_endpoint.change(make_event('c', status='cancelled'))
+    fake_endpoint.change(make_event('d', day=30))  # Outside the window
+
+    delta = sync_meetings_from_gcal(*sync_window, sync_token=sync.sync_token)
+    meetings = list(delta)
+    assert not delta.full_sync
+    assert [m['id'] for m in meetings] == ['b']
+    assert meetings[0]['title'] == 'Renamed'
+    assert delta.removed_ids == ['c', 'd']
+    assert delta.sync_token == '3'
+    assert fake_endpoint.requests[-1]['syncToken'] == sync.sync_token
+
+def test_sync_meetings_expired_token_full_resync(fake_endpoint, sync_window):
+    fake_endpoint.expired_tokens.add('stale')
+    sync = sync_meetings_from_gcal(*sync_window, sync_token='stale')
+    assert sync.full_sync
+    assert len(list(sync)) == 3
+    assert sync.sync_token == '0'
@@ -34,13 +34,12 @@ async def test_startup():
     app.bot = AsyncMock()
     app.job_queue = AsyncMock()
     app.job_queue.run_repeating = Mock()  # Change to regular Mock since we don't need to await this
-    context = Mock(spec=ContextTypes.DEFAULT_TYPE)
+    app.create_task = Mock(side_effect=lambda coro: coro.close())
     
     # Mock the jobs
     with patch('src.main.refresh_meetings') as mock_refresh, \
-         patch('src.main.notification_job') as mock_notify:
+         patch('src.main.reminder_scheduler') as mock_scheduler:
         mock_refresh.return_value = None
-        mock_notify.return_value = None
         
         async def post_init(app):
             await app.bot.set_my_commands([
@@ -52,28 +51,28 @@ async def test_startup():
             ])
             await startup(app)
             
-            # Get and call the job callbacks
+            # Get and call the job callback
             refresh_callback = app.job_queue.run_repeating.call_args_list[0][0][0]
-            notify_callback = app.job_queue.run_repeating.call_args_list[1][0][0]
             
-            # Mock the callback executions
+            # Mock the callback execution
             if asyncio.iscoroutinefunction(refresh_callback):
                 await refresh_callback()
-            if asyncio.iscoroutinefunction(notify_callback):
-                await notify_callback(context)
         
         app.post_init = post_init
         await app.post_init(app)
         
         # Verify calls
         app.bot.set_my_commands.assert_called_once()
-        assert app.job_queue.run_repeating.call_count == 2
+        assert app.job_queue.run_repeating.call_count == 1
         assert mock_refresh.called
-        assert mock_notify.called
+        # Reminders are driven by the scheduler task instead of a polling job
+        app.create_task.assert_called_once()
+        mock_scheduler.run.assert_called_once()
 
 @pytest.mark.asyncio
 async def test_startup_error():
     app = Mock()
     app.bot = AsyncMock()
     app.bot.set_my_commands.side_effect = Exception("Test error")
+    app.create_task = Mock(side_effect=lambda coro: coro.close())
     await startup(app)  # Should handle error gracefully
@@ -1,4 +1,7 @@
 import pytest
+import asyncio
+import threading
+import time
 from datetime import datetime, timedelta, UTC
 from unittest.mock import Mock, patch, AsyncMock
 from dateutil import tz
@@ -11,7 +14,10 @@ from src.notifications import (
     compare_datetimes,
     send_notification,
     refresh_meetings,
-    notification_job
+    send_due_reminders,
+    _meeting_row_values,
+    _sync_meetings_to_db,
+    _sync_state
 )
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, create_engine
 from sqlalchemy.orm import declarative_base
@@ -39,6 +45,21 @@ class MeetingModel(Base):
     location = Column(String)
     description = Column(String)
     updated = Column(String)
+    etag = Column(String)
+    content_hash = Column(String)
+
+class FakeSync:
+    """Stand-in for google_calendar.CalendarSync over already transformed meetings."""
+
+    def __init__(self, meetings, full_sync=True, removed_ids=None, sync_token=None):
+        self.meetings = meetings
+        self.full_sync = full_sync
+        self.removed_ids = removed_ids or []
+        self.sync_token = sync_token
+
+    def chunks(self, size):
+        for i in range(0, len(self.meetings), size):
+            yield self.meetings[i:i + size]
 
 @pytest.fixture
 def sample_meeting_dict():
@@ -92,6 +113,23 @@ def mock_create_engine():
         mock_engine.return_value = create_engine('sqlite:///:memory:')
         yield mock_engine
 
+@pytest.fixture
+def mock_writes():
+    writes = Mock()
+    with patch('src.notifications.upsert_meetings', writes.upsert), \
+         patch('src.notifications.update_meetings', writes.update), \
+         patch('src.notifications.delete_meetings', writes.delete), \
+         patch('src.notifications.delete_meetings_except', writes.delete_except):
+        yield writes
+
+def written_ids(write_mock):
+    return [row["id"] for row in write_mock.call_args[0][1]]
+
+@pytest.fixture(autouse=True)
+def reset_sync_state():
+    with patch.dict('src.notifications._sync_state', {"token": None, "window": None}):
+        yield
+
 @pytest.fixture(autouse=True)
 def mock_database_url():
     with patch('database.DATABASE_URL', 'sqlite:///:memory:'):  # Updated path
@@ -185,7 +223,7 @@ async def test_send_notification_formatting_error(mock_bot):
         mock_bot.send_message.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_refresh_meetings_new_meeting(mock_create_engine, mock_session, sample_meeting_dict):
+async def test_refresh_meetings_new_meeting(mock_create_engine, mock_session, mock_writes, sample_meeting_dict):
     query_mock = mock_session.query.return_value
     query_mock.all.side_effect = [
         [],  # First call for UserSettings.notify_new
@@ -193,16 +231,19 @@ async def test_refresh_meetings_new_meeting(mock_create_engine, mock_session, sa
     ]
     
     with patch('src.notifications.SessionLocal', return_value=mock_session), \
-         patch('src.notifications.fetch_meetings_from_gcal', return_value=[sample_meeting_dict]):
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([sample_meeting_dict])):
         await refresh_meetings()
         
-        # Verify the calls
-        query_mock.delete.assert_called_once()
-        mock_session.add.assert_called_once()
+        # Verify the calls: one bulk insert, stale rows swept, nothing updated
+        assert written_ids(mock_writes.upsert) == [sample_meeting_dict["id"]]
+        assert written_ids(mock_writes.update) == []
+        mock_writes.delete_except.assert_called_once_with(mock_session, {sample_meeting_dict["id"]})
+        mock_session.query.return_value.delete.assert_not_called()
+        mock_session.add.assert_not_called()
         mock_session.commit.assert_called_once()
 
 @pytest.mark.asyncio
-async def test_refresh_meetings_updated_meeting(mock_create_engine, mock_session, sample_meeting_dict):
+async def test_refresh_meetings_updated_meeting(mock_create_engine, mock_session, mock_writes, sample_meeting_dict):
     existing_meeting = MeetingModel(
         id="36828kaerpn17l08dma0gdd09f_20241217T080000Z",
         title="Old Title",
@@ -219,89 +260,91 @@ async def test_refresh_meetings_updated_meeting(mock_create_engine, mock_session
     ]
     
     with patch('src.notifications.SessionLocal', return_value=mock_session), \
-         patch('src.notifications.fetch_meetings_from_gcal', return_value=[sample_meeting_dict]):
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([sample_meeting_dict])):
         await refresh_meetings()
         
-        # Verify the calls
-        query_mock.delete.assert_called_once()
-        mock_session.add.assert_called_once()
+        # Verify the calls: only the changed row is updated
+        assert written_ids(mock_writes.upsert) == []
+        updated_row = mock_writes.update.call_args[0][1][0]
+        assert updated_row["id"] == sample_meeting_dict["id"]
+        assert updated_row["title"] == sample_meeting_dict["title"]
+        assert updated_row["attendants"] == ",".join(sample_meeting_dict["attendants"])
+        mock_writes.delete_except.assert_called_once()
         mock_session.commit.assert_called_once()
 
 @pytest.mark.asyncio
-async def test_notification_job_edge_cases(mock_session):
-    # Test with invalid start_time
-    invalid_meeting = MeetingModel(
+async def test_send_due_reminders_skips_stale(mock_session, mock_bot):
+    now = datetime.now(UTC)
+    # The meeting moved after its reminder was scheduled
+    moved_meeting = MeetingModel(
         id="test_id",
         title="Test Meeting",
-        start_time=None,  # Invalid start time
-        end_time=datetime.now(UTC)
+        start_time=now + timedelta(minutes=30),
+        end_time=now + timedelta(minutes=90)
     )
-    
+    user = UserSettingsModel(user_id=123, notify_1h=True, notify_15m=True, notify_5m=True)
+
     query_mock = mock_session.query.return_value
     query_mock.all.side_effect = [
-        [invalid_meeting],  # Meetings
-        []  # Users
+        [moved_meeting],  # Meetings
+        [user]  # Users
     ]
-    
-    with patch('src.notifications.SessionLocal', return_value=mock_session):
-        await notification_job(None)
-        # Should not raise any errors and skip invalid meeting
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.bot', mock_bot):
+        await send_due_reminders([("test_id", "15m", now + timedelta(minutes=15)), ("missing", "5m", now)])
+        mock_bot.send_message.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_notification_job_windows(mock_session, mock_bot):
+async def test_send_due_reminders_kinds(mock_session, mock_bot):
     now = datetime.now(UTC)
-    
-    # Create meetings at different notification windows
+
     meetings = [
-        MeetingModel(  # 60-minute window
+        MeetingModel(
             id="60min",
             title="60min Meeting",
             start_time=now + timedelta(minutes=60),
             end_time=now + timedelta(minutes=120)
         ),
-        MeetingModel(  # 15-minute window
+        MeetingModel(
             id="15min",
             title="15min Meeting",
             start_time=now + timedelta(minutes=15),
             end_time=now + timedelta(minutes=75)
         ),
-        MeetingModel(  # 5-minute window
+        MeetingModel(
             id="5min",
             title="5min Meeting",
             start_time=now + timedelta(minutes=5),
             end_time=now + timedelta(minutes=65)
         ),
-        MeetingModel(  # Just outside window
-            id="outside",
-            title="Outside Window",
-            start_time=now + timedelta(minutes=62),
-            end_time=now + timedelta(minutes=122)
-        )
     ]
-    
-    # Create test user with all notifications enabled
-    user = UserSettingsModel(
-        user_id=123,
-        notify_1h=True,
-        notify_15m=True,
-        notify_5m=True
-    )
-    
+    due = [
+        ("60min", "1h", meetings[0].start_time),
+        ("15min", "15m", meetings[1].start_time),
+        ("5min", "5m", meetings[2].start_time),
+    ]
+
+    all_kinds = UserSettingsModel(user_id=123, notify_1h=True, notify_15m=True, notify_5m=True)
+    only_5m = UserSettingsModel(user_id=456, notify_1h=False, notify_15m=False, notify_5m=True)
+
     query_mock = mock_session.query.return_value
     query_mock.all.side_effect = [
-        meetings,  # First call for meetings
-        [user]    # Second call for users
+        meetings,  # Due meetings
+        [all_kinds, only_5m]  # Users with any reminder enabled
     ]
-    
+
     with patch('src.notifications.SessionLocal', return_value=mock_session), \
          patch('src.notifications.bot', mock_bot):
-        await notification_job(None)
-        
-        # Should send notifications for meetings in windows, skip the outside one
-        assert mock_bot.send_message.call_count == 3
+        await send_due_reminders(due)
+
+        # Three reminders for the first user, one for the second
+        assert mock_bot.send_message.call_count == 4
+        recipients = [c.kwargs["chat_id"] for c in mock_bot.send_message.call_args_list]
+        assert recipients.count(456) == 1
 
 @pytest.mark.asyncio
-async def test_refresh_meetings_duplicate_ids(mock_session, sample_meeting_dict):
+async def test_refresh_meetings_duplicate_ids(mock_session, mock_writes, sample_meeting_dict):
     # Test handling of duplicate meeting IDs
     duplicate_dict = sample_meeting_dict.copy()
     duplicate_dict["title"] = "Duplicate Meeting"
@@ -313,12 +356,13 @@ async def test_refresh_meetings_duplicate_ids(mock_session, sample_meeting_dict)
     ]
     
     with patch('src.notifications.SessionLocal', return_value=mock_session), \
-         patch('src.notifications.fetch_meetings_from_gcal', 
-               return_value=[sample_meeting_dict, duplicate_dict]):
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([sample_meeting_dict, duplicate_dict])):
         await refresh_meetings()
         
-        # Should handle duplicates gracefully
-        assert mock_session.add.call_count == 2
+        # Should handle duplicates gracefully: the last version is inserted once
+        rows = mock_writes.upsert.call_args[0][1]
+        assert len(rows) == 1
+        assert rows[0]["title"] == "Duplicate Meeting"
         mock_session.commit.assert_called_once()
 
 @pytest.mark.asyncio
@@ -334,10 +378,168 @@ async def test_refresh_meetings_attendee_filtering(mock_session, sample_meeting_
     ]
     
     with patch('src.notifications.SessionLocal', return_value=mock_session), \
-         patch('src.notifications.fetch_meetings_from_gcal', return_value=[sample_meeting_dict]), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([sample_meeting_dict])), \
          patch('src.notifications.send_notification') as mock_send:
         await refresh_meetings()
         
         # Should only notify user1 who is in attendees
         assert mock_send.call_count == 1
         mock_send.assert_called_with(123, sample_meeting_dict, is_new=True)
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_reuses_sync_token(mock_session, mock_writes, sample_meeting_dict):
+    query_mock = mock_session.query.return_value
+    query_mock.all.return_value = []
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal') as mock_sync:
+        mock_sync.side_effect = [
+            FakeSync([sample_meeting_dict], sync_token="token-1"),
+            FakeSync([], full_sync=False, removed_ids=["gone"], sync_token="token-2"),
+        ]
+        await refresh_meetings()
+        await refresh_meetings()
+
+        assert mock_sync.call_args_list[0][0][2] is None
+        assert mock_sync.call_args_list[1][0][2] == "token-1"
+        assert _sync_state["token"] == "token-2"
+        # Stale rows are swept after the full sync, removals applied after the incremental one
+        mock_writes.delete_except.assert_called_once()
+        mock_writes.delete.assert_called_once_with(mock_session, ["gone"])
+        assert mock_writes.upsert.call_count == 2
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_no_changes(mock_session, mock_writes):
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal',
+               return_value=FakeSync([], full_sync=False, sync_token="token-2")):
+        await refresh_meetings()
+
+        assert written_ids(mock_writes.upsert) == []
+        assert written_ids(mock_writes.update) == []
+        mock_writes.delete.assert_not_called()
+        mock_writes.delete_except.assert_not_called()
+        assert _sync_state["token"] == "token-2"
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_processes_chunks(mock_session, mock_writes, sample_meeting_dict):
+    meetings = [dict(sample_meeting_dict, id=f"meeting-{i}") for i in range(5)]
+    query_mock = mock_session.query.return_value
+    query_mock.all.return_value = []
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.REFRESH_CHUNK_SIZE', 2), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync(meetings)):
+        await refresh_meetings()
+
+        # Subscribers plus one lookup of existing rows per chunk of two
+        assert query_mock.all.call_count == 4
+        assert len(written_ids(mock_writes.upsert)) == 5
+        mock_session.commit.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_does_not_block_event_loop(sample_meeting_dict):
+    started = threading.Event()
+
+    def slow_sync(start, end, sync_token, cancel_event):
+        started.set()
+        time.sleep(0.3)
+        return [], [], "token-1"
+
+    with patch('src.notifications._sync_meetings_to_db', side_effect=slow_sync):
+        refresh = asyncio.create_task(refresh_meetings())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        # The loop keeps serving other coroutines while the refresh is in flight
+        loop_started = time.monotonic()
+        await asyncio.sleep(0.01)
+        assert time.monotonic() - loop_started < 0.2
+        assert not refresh.done()
+        await refresh
+
+    assert _sync_state["token"] == "token-1"
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_timeout_cancels_worker():
+    cancelled = threading.Event()
+
+    def hanging_sync(start, end, sync_token, cancel_event):
+        cancel_event.wait(2)
+        if cancel_event.is_set():
+            cancelled.set()
+        return None
+
+    with patch('src.notifications._sync_meetings_to_db', side_effect=hanging_sync), \
+         patch('src.notifications.REFRESH_TIMEOUT', 0.05), \
+         patch('src.notifications.send_notification') as mock_send:
+        await refresh_meetings()
+        await asyncio.get_running_loop().run_in_executor(None, cancelled.wait, 2)
+
+        assert cancelled.is_set()
+        mock_send.assert_not_called()
+        assert _sync_state["token"] is None
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_cancelled_worker_rolls_back(mock_session, sample_meeting_dict):
+    mock_session.query.return_value.all.return_value = []
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([sample_meeting_dict])):
+        assert _sync_meetings_to_db(None, None, None, cancel_event) is None
+
+        mock_session.commit.assert_not_called()
+        mock_session.rollback.assert_called_once()
+
+def stored_meeting(meeting_dict):
+    values = _meeting_row_values(meeting_dict)
+    return MeetingModel(id=meeting_dict["id"], **values)
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_skips_matching_etag(mock_session, mock_writes, sample_meeting_dict):
+    meeting = dict(sample_meeting_dict, etag='"etag-1"')
+    mock_session.query.return_value.all.side_effect = [[], [stored_meeting(meeting)]]
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([meeting])), \
+         patch('src.notifications._meeting_row_values') as mock_values, \
+         patch('src.notifications.send_notification') as mock_send:
+        await refresh_meetings()
+
+        mock_values.assert_not_called()
+        mock_send.assert_not_called()
+        assert written_ids(mock_writes.upsert) == []
+        assert written_ids(mock_writes.update) == []
+        mock_writes.delete_except.assert_called_once_with(mock_session, {meeting["id"]})
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_same_hash_new_etag(mock_session, mock_writes, sample_meeting_dict):
+    existing = stored_meeting(dict(sample_meeting_dict, etag='"etag-1"'))
+    meeting = dict(sample_meeting_dict, etag='"etag-2"', updated="2024-12-13T10:00:00.000Z")
+    subscriber = UserSettingsModel(user_id=123, notify_new=True, filter_by_attendant=False)
+    mock_session.query.return_value.all.side_effect = [[subscriber], [existing]]
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([meeting])), \
+         patch('src.notifications.send_notification') as mock_send:
+        await refresh_meetings()
+
+        # The new etag is stored but subscribers are not notified
+        mock_send.assert_not_called()
+        assert mock_writes.update.call_args[0][1][0]["etag"] == '"etag-2"'
+
+@pytest.mark.asyncio
+async def test_refresh_meetings_changed_hash_notifies(mock_session, mock_writes, sample_meeting_dict):
+    existing = stored_meeting(dict(sample_meeting_dict, etag='"etag-1"'))
+    meeting = dict(sample_meeting_dict, etag='"etag-2"', location="Room 2")
+    subscriber = UserSettingsModel(user_id=123, notify_new=True, filter_by_attendant=False)
+    mock_session.query.return_value.all.side_effect = [[subscriber], [existing]]
+
+    with patch('src.notifications.SessionLocal', return_value=mock_session), \
+         patch('src.notifications.sync_meetings_from_gcal', return_value=FakeSync([meeting])), \
+         patch('src.notifications.send_notification') as mock_send:
+        await refresh_meetings()
+
+        mock_send.assert_called_once_with(123, meeting, is_new=True)
+        row = mock_writes.update.call_args[0][1][0]
+        assert row["content_hash"] != existing.content_hash
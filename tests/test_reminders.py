@@ -0,0 +1,68 @@
+import pytest
+import asyncio
+from datetime import datetime, timedelta, UTC
+from src.reminders import ReminderScheduler
+
+NOW = datetime(2024, 12, 17, 8, 0, tzinfo=UTC)
+
+@pytest.fixture
+def scheduler():
+    return ReminderScheduler(now=NOW)
+
+def test_load_precomputes_fire_times(scheduler):
+    scheduler.load([
+        ("a", NOW + timedelta(minutes=90)),
+        ("b", (NOW + timedelta(minutes=20)).replace(tzinfo=None)),  # Naive UTC from the database
+    ])
+    # b's 1-hour reminder is already in the past
+    assert len(scheduler) == 5
+    assert scheduler.next_fire_time() == NOW + timedelta(minutes=5)
+
+def test_pop_due_in_time_order(scheduler):
+    start = NOW + timedelta(minutes=60)
+    scheduler.load([("a", start), ("b", start + timedelta(minutes=1))])
+
+    assert scheduler.pop_due(NOW - timedelta(seconds=1)) == []
+    assert scheduler.pop_due(NOW) == [("a", "1h", start)]
+    due = scheduler.pop_due(NOW + timedelta(minutes=56))
+    assert due == [
+        ("b", "1h", start + timedelta(minutes=1)),
+        ("a", "15m", start),
+        ("b", "15m", start + timedelta(minutes=1)),
+        ("a", "5m", start),
+    ]
+    assert scheduler.next_fire_time() == start + timedelta(minutes=1) - timedelta(minutes=5)
+
+def test_reload_does_not_repeat_fired_reminders(scheduler):
+    start = NOW + timedelta(minutes=60)
+    scheduler.load([("a", start)])
+    assert len(scheduler.pop_due(NOW + timedelta(minutes=1))) == 1
+
+    scheduler.load([("a", start)])
+    assert [kind for _, kind, _ in scheduler.pop_due(start)] == ["15m", "5m"]
+
+def test_reload_reschedules_moved_meeting(scheduler):
+    scheduler.load([("a", NOW + timedelta(minutes=60))])
+    scheduler.load([("a", NOW + timedelta(minutes=120))])
+    assert scheduler.next_fire_time() == NOW + timedelta(minutes=60)
+    assert scheduler.pop_due(NOW + timedelta(minutes=30)) == []
+
+@pytest.mark.asyncio
+async def test_run_wakes_when_reminder_is_due():
+    now = datetime.now(UTC)
+    scheduler = ReminderScheduler(now=now)
+    delivered = asyncio.Queue()
+
+    async def deliver(due):
+        await delivered.put(due)
+
+    task = asyncio.create_task(scheduler.run(deliver))
+    try:
+        await asyncio.sleep(0.01)
+        assert delivered.empty()
+        # Loading wakes the sleeping loop, which then sleeps until the fire time
+        scheduler.load([("a", now + timedelta(minutes=5, seconds=0.1))])
+        due = await asyncio.wait_for(delivered.get(), 1)
+        assert due == [("a", "5m", now + timedelta(minutes=5, seconds=0.1))]
+    finally:
+        task.cancel()